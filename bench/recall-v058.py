@@ -25,19 +25,34 @@ class McpClient:
             text=self.buf.decode(errors="replace")
             while "\n" in text:
                 line,rest=text.split("\n",1); line=line.strip()
-                if not line: text=rest; self.buf=rest.encode(); continue
+                if line[:1]!="{": text=rest; self.buf=rest.encode(); continue
                 try:
                     obj=json.loads(line); self.buf=rest.encode(); return obj
                 except: text=rest; self.buf=rest.encode(); continue
         return None
+    def _request(self, method, params):
+        self.id+=1; self._send({"jsonrpc":"2.0","id":self.id,"method":method,"params":params})
+        while True:
+            r=self._recv()
+            # Drop late replies to earlier timed-out requests so they can't pass for this one.
+            if r is None or r.get("id")==self.id: return r
     def _init(self):
-        self._send({"jsonrpc":"2.0","id":1,"method":"initialize","params":{
-            "protocolVersion":"2024-11-05","capabilities":{},"clientInfo":{"name":"bench","version":"1.0"}}})
-        self._recv()
+        self._request("initialize",{
+            "protocolVersion":"2024-11-05","capabilities":{},"clientInfo":{"name":"bench","version":"1.0"}})
         self._send({"jsonrpc":"2.0","method":"notifications/initialized"})
-        time.sleep(0.8)
+        self._wait_ready()
+    def _wait_ready(self, timeout=30):
+        deadline=time.time()+timeout
+        while time.time()<deadline:
+            r=self.call("codedb_status",{})
+            if r is None: continue  # no reply in time: stalled, not an older server
+            text="".join(c.get("text","") for c in r.get("result",{}).get("content",[]))
+            if "scan:" not in text: time.sleep(0.8); return  # older servers don't report scan state
+            if "scan: ready" in text: return
+            time.sleep(0.05)
+        print(f"  {Y}warning: {self.proc.args[0]} scan not ready after {timeout}s{N}",flush=True)
     def call(self, tool, args):
-        self.id+=1; self._send({"jsonrpc":"2.0","id":self.id,"method":"tools/call","params":{"name":tool,"arguments":args}}); return self._recv()
+        return self._request("tools/call",{"name":tool,"arguments":args})
     def search(self, query): return self.call("codedb_search",{"query":query,"max_results":MAX_RESULTS})
     def close(self): self.proc.terminate(); self.proc.wait()
 
@@ -48,7 +63,7 @@ def grep_truth(query, src_dir):
         for f in fnames:
             path=os.path.join(root,f)
             try:
-                content=open(path,errors='ignore').read().lower()
+                with open(path,errors='ignore') as fh: content=fh.read().lower()
                 if q in content: files.add(path)
             except: pass
     return len(files)
@@ -75,17 +90,19 @@ def parse_files(resp):
     except: return set()
 
 def time_search(client, query, iters=ITERS):
-    client.search(query)
+    # The warmup response doubles as the recall sample — servers wait for scan: ready at startup,
+    # so it is served from the complete index.
+    warm=client.search(query)
     s=[]
     for _ in range(iters):
         t0=time.perf_counter(); client.search(query); s.append((time.perf_counter()-t0)*1000)
-    return statistics.median(s)
+    return statistics.median(s), warm
 
 def geomean(vals):
     return math.exp(sum(math.log(max(v,0.001)) for v in vals)/len(vals))
 
-cpu=subprocess.run(["sysctl","-n","machdep.cpu.brand_string"],capture_output=True,text=True).stdout.strip()
-ram=int(subprocess.run(["sysctl","-n","hw.memsize"],capture_output=True,text=True).stdout.strip())//(1024**3)
+cpu,memsize=subprocess.run(["sysctl","-n","machdep.cpu.brand_string","hw.memsize"],capture_output=True,text=True).stdout.strip().split("\n")
+ram=int(memsize)//(1024**3)
 
 print(f"\n{W}{'='*72}{N}")
 print(f"{W}  codedb v0.2.572 vs v0.2.58 — identifier-splitting benchmark{N}")
@@ -113,6 +130,7 @@ src_dir=os.path.join(REPO,"src")
 print(f"\n{D}  Computing grep ground truth...{N}",flush=True)
 truth={q:grep_truth(q,src_dir) for q,_,_ in QUERIES}
 print(f"{D}  Starting MCP servers...{N}",flush=True)
+# Start servers one at a time: both index the same REPO into the same ~/.codedb project dir.
 oc=McpClient(OLD,REPO); nc=McpClient(NEW,REPO)
 print(f"  {G}OK{N} Both servers ready\n",flush=True)
 
@@ -120,8 +138,8 @@ print(f"  {'Query':<14} {'Grp':<4} {'v0.2.572':>10}  {'v0.2.58':>9}  {'Spdup':>6
 print("  "+"-"*70)
 rows=[]
 for query,group,desc in QUERIES:
-    old_ms=time_search(oc,query); new_ms=time_search(nc,query)
-    old_f=parse_files(oc.search(query)); new_f=parse_files(nc.search(query))
+    old_ms,old_resp=time_search(oc,query); new_ms,new_resp=time_search(nc,query)
+    old_f=parse_files(old_resp); new_f=parse_files(new_resp)
     gt=truth[query]; spd=old_ms/new_ms if new_ms>0 else 99
     dr=len(new_f)-len(old_f)
     cs=G if spd>=1.3 else (Y if spd>=0.9 else R)
@@ -136,4 +154,6 @@ print(f"  {'-'*55}")
 print(f"  SUB-TOKEN:  speedup {G}{geomean([r[4] for r in sub]):.1f}x{N}  recall gain {G}{sum(r[8] for r in sub):+d} files{N}")
 print(f"  FULL ident: speedup {Y}{geomean([r[4] for r in full]):.1f}x{N}  recall gain {sum(r[8] for r in full):+d} files\n")
 
-oc.close(); nc.close()
+# Signal both servers before reaping either so their shutdowns overlap.
+for c in (oc,nc): c.proc.terminate()
+for c in (oc,nc): c.proc.wait()